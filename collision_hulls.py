@@ -0,0 +1,198 @@
+import id_map
+
+__author__ = 'Ryan Sheffer'
+
+# Entities whose brushes never move, their hulls can be merged with the world's
+STATIC_CLASSNAMES = id_map.Id2Map.Entity.WORLD_CLASSNAMES + ('func_wall',)
+
+
+class CollisionHull:
+    """
+    A convex collision hull, the points and polygons of a solid brush.
+    Axial brushes also keep their bounds as a box, which is what lets neighbouring hulls be merged.
+    """
+    def __init__(self, points, polygons, box=None, brush_index=None):
+        self.points = points  # list of (x, y, z)
+        self.polygons = polygons  # list of lists of point indices
+        self.box = box  # (mins, maxs) if the hull is an axis aligned box
+        self.brush_index = brush_index  # scene index of the brush whose render mesh the hull collides for
+
+    def get_key(self):
+        """ Hulls with the same points are the same hull, brushes are convex """
+        return tuple(sorted(self.points))
+
+    @staticmethod
+    def from_brush(brush, brush_index=None):
+        """
+        Creates the hull of a brush from its face windings, the points shared by faces are merged
+        :param brush: The brush to make the hull of
+        :param brush_index: The scene index of the brush
+        :return The hull, or None if the brush does not have enough faces left to be closed
+        """
+        points = []
+        point_indices = {}
+        polygons = []
+        for face in brush.faces:
+            if face.winding is None:
+                continue
+
+            polygon = []
+            for i in range(0, face.winding.numpoints):
+                # Windings of neighbouring faces don't quite agree on the shared points
+                point = tuple(round(face.winding.points[i][j], 2) for j in range(0, 3))
+                if point not in point_indices:
+                    point_indices[point] = len(points)
+                    points.append(point)
+                polygon.append(point_indices[point])
+            polygons.append(polygon)
+
+        if len(polygons) < 4:
+            return None
+
+        box = None
+        if brush.is_axial():
+            box = (list(brush.mins), list(brush.maxs))
+        return CollisionHull(points, polygons, box, brush_index)
+
+    @staticmethod
+    def from_box(mins, maxs, brush_index=None):
+        """ Creates the hull of an axis aligned box, with the same winding order as the brush windings """
+        points = []
+        for i in range(0, 8):
+            points.append((maxs[0] if i & 1 else mins[0], maxs[1] if i & 2 else mins[1], maxs[2] if i & 4 else mins[2]))
+
+        # Clockwise when seen from outside, bit 0 of the point index is x, bit 1 is y, bit 2 is z
+        polygons = [[2, 6, 4, 0], [5, 7, 3, 1],   # -x, +x
+                    [4, 5, 1, 0], [3, 7, 6, 2],   # -y, +y
+                    [1, 3, 2, 0], [6, 7, 5, 4]]   # -z, +z
+        return CollisionHull(points, polygons, (list(mins), list(maxs)), brush_index)
+
+
+def is_solid_brush(brush):
+    """ If the brush blocks movement, liquids, mist and origin brushes have no collision """
+    solid = id_map.Id2Map.TexDef.CONTENTS_SOLID | id_map.Id2Map.TexDef.CONTENTS_WINDOW | \
+        id_map.Id2Map.TexDef.CONTENTS_PLAYERCLIP | id_map.Id2Map.TexDef.CONTENTS_MONSTERCLIP
+
+    contents = brush.get_contents()
+    return contents & solid != 0 and contents & id_map.Id2Map.TexDef.CONTENTS_ORIGIN == 0
+
+
+def is_static_entity(entity):
+    """ If the brushes of the entity are part of the world, which is never true for doors, platforms and such """
+    return entity.properties.get('classname', '') in STATIC_CLASSNAMES
+
+
+def build_entity_hulls(entity, brush_index, skip_classnames=('trigger_',)):
+    """
+    Creates the collision hulls of the solid brushes of an entity
+    :param entity: The entity to take the brushes from
+    :param brush_index: The scene index of the first brush of the entity
+    :param skip_classnames: Entities with a classname starting with one of these get no collision
+    :return List of CollisionHull
+    """
+    classname = entity.properties.get('classname', '')
+    for skip in skip_classnames:
+        if classname.startswith(skip):
+            return []
+
+    hulls = []
+    for entity_brush_index in range(0, len(entity.brushes)):
+        brush = entity.brushes[entity_brush_index]
+        if not is_solid_brush(brush):
+            continue
+
+        hull = CollisionHull.from_brush(brush, brush_index + entity_brush_index)
+        if hull is not None:
+            hulls.append(hull)
+
+    return hulls
+
+
+def deduplicate_hulls(hulls):
+    """ Removes hulls which are exactly the same as a hull earlier in the list """
+    seen = set()
+    unique = []
+    for hull in hulls:
+        key = hull.get_key()
+        if key not in seen:
+            seen.add(key)
+            unique.append(hull)
+
+    return unique
+
+
+def merge_box_hulls(hulls, merge_size):
+    """
+    Merges box hulls which share a whole face into one box, as the union of those is still convex.
+    Boxes only get merged as long as the result stays within merge_size on every axis, which keeps
+    the merged hulls tight around the geometry.
+    :param hulls: The hulls to merge, hulls which are not boxes are left alone
+    :param merge_size: The largest a merged box can get along any axis
+    :return The list of hulls after merging
+    """
+    boxes = [hull.box for hull in hulls if hull.box is not None]
+    box_brushes = [hull.brush_index for hull in hulls if hull.box is not None]
+    others = [hull for hull in hulls if hull.box is None]
+
+    merged_any = True
+    while merged_any:
+        merged_any = False
+        for axis in range(0, 3):
+            other_axes = [i for i in range(0, 3) if i != axis]
+
+            # Index the boxes by the face they have at their minimum along the axis
+            by_min_face = {}
+            for box_index in range(0, len(boxes)):
+                mins, maxs = boxes[box_index]
+                key = (mins[axis],) + tuple(mins[i] for i in other_axes) + tuple(maxs[i] for i in other_axes)
+                by_min_face.setdefault(key, []).append(box_index)
+
+            removed = set()
+            for box_index in range(0, len(boxes)):
+                if box_index in removed:
+                    continue
+
+                mins, maxs = boxes[box_index]
+                if maxs[axis] - mins[axis] > merge_size:
+                    continue
+
+                # A box whose minimum face is our maximum face shares the whole face with us
+                key = (maxs[axis],) + tuple(mins[i] for i in other_axes) + tuple(maxs[i] for i in other_axes)
+                for other_index in by_min_face.get(key, []):
+                    if other_index in removed or other_index == box_index:
+                        continue
+
+                    other_maxs = boxes[other_index][1]
+                    if other_maxs[axis] - mins[axis] > merge_size:
+                        continue
+
+                    maxs = list(maxs)
+                    maxs[axis] = other_maxs[axis]
+                    boxes[box_index] = (mins, maxs)
+                    removed.add(other_index)
+                    merged_any = True
+                    break
+
+            # The merged box stays with the brush of the box it grew from
+            boxes = [boxes[i] for i in range(0, len(boxes)) if i not in removed]
+            box_brushes = [box_brushes[i] for i in range(0, len(box_brushes)) if i not in removed]
+
+    return [CollisionHull.from_box(boxes[i][0], boxes[i][1], box_brushes[i]) for i in range(0, len(boxes))] + others
+
+
+def optimize_hull_groups(hull_groups, merge_size):
+    """
+    Removes duplicate hulls and merges boxes within each group of hulls, hulls of different groups are never
+    combined, so a door does not end up sharing a hull with the wall next to it
+    :param hull_groups: List of lists of hulls, the static hulls of the map and one list per moving entity
+    :param merge_size: The largest a merged box can get along any axis, 0 to not merge
+    :return The list of groups after optimizing
+    """
+    optimized = []
+    for hulls in hull_groups:
+        hulls = deduplicate_hulls(hulls)
+        if merge_size > 0:
+            hulls = merge_box_hulls(hulls, merge_size)
+        optimized.append(hulls)
+
+    return optimized
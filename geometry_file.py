@@ -0,0 +1,223 @@
+import array
+import mmap
+import struct
+import sys
+
+__author__ = 'Ryan Sheffer'
+
+# File layout, all little endian:
+#   header: magic, version, number of sections
+#   section table: per section its name, byte offset and number of values
+#   section data: flat arrays of 32 bit values, each starting on an 8 byte boundary
+#
+# Sections, with the values making up one item:
+#   planes     f: normal x, normal y, normal z, dist          one per face
+#   points     f: x, y, z                                     one per polygon point
+#   uvs        f: s, t                                        one per polygon point
+#   polygons   i: first point, num points, plane, texture     one per exported polygon, texture is -1 if none
+#   brushes    i: first plane, num planes, first polygon, num polygons
+#   bounds     f: mins x, y, z, maxs x, y, z                  one per brush
+#   entities   i: first brush, num brushes, first property, num properties
+#   properties i: key string, value string
+#   textures   i: path string, width, height
+#   strings    i: byte offset of each string in the string data, plus the end offset
+#   strdata    B: utf-8 string data
+MAGIC = b'Q2GEOM\0\0'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sII')
+SECTION = struct.Struct('<16sQQ')
+
+SECTIONS = [('planes', 'f', 4), ('points', 'f', 3), ('uvs', 'f', 2), ('polygons', 'i', 4), ('brushes', 'i', 4),
+            ('bounds', 'f', 6), ('entities', 'i', 4), ('properties', 'i', 2), ('textures', 'i', 3),
+            ('strings', 'i', 1), ('strdata', 'B', 1)]
+
+
+def array_to_bytes(values):
+    """ The raw bytes of an array, Python 2 arrays only have tostring """
+    if hasattr(values, 'tobytes'):
+        return values.tobytes()
+    return values.tostring()
+
+
+def write_geometry_file(file_name, entities):
+    """
+    Writes the geometry of the parsed entities into a geometry file, what gets written for the faces
+    is what would be exported, so CSG has to run before this.
+    :param file_name: The geometry file to write
+    :param entities: The parsed map entities
+    """
+    data = dict((name, array.array(type_code)) for name, type_code, _ in SECTIONS)
+    strings = []
+    string_indices = {}
+    texture_indices = {}
+
+    def add_string(value):
+        if value not in string_indices:
+            string_indices[value] = len(strings)
+            strings.append(value)
+        return string_indices[value]
+
+    for entity in entities:
+        data['entities'].extend([len(data['brushes']) // 4, len(entity.brushes),
+                                 len(data['properties']) // 2, len(entity.properties)])
+        for key in sorted(entity.properties.keys()):
+            data['properties'].extend([add_string(key), add_string(entity.properties[key])])
+
+        for brush in entity.brushes:
+            data['brushes'].extend([len(data['planes']) // 4, len(brush.faces),
+                                    len(data['polygons']) // 4, 0])
+            data['bounds'].extend(brush.mins + brush.maxs)
+            num_polygons = 0
+
+            for face in brush.faces:
+                plane_index = len(data['planes']) // 4
+                data['planes'].extend(face.plane.normal + [face.plane.dist])
+
+                texture_index = -1
+                if face.texture is not None:
+                    texture_path = face.texture.texture_path
+                    if texture_path not in texture_indices:
+                        texture_indices[texture_path] = len(data['textures']) // 3
+                        data['textures'].extend([add_string(texture_path), face.texture.width, face.texture.height])
+                    texture_index = texture_indices[texture_path]
+
+                for winding in face.visible_windings():
+                    data['polygons'].extend([len(data['points']) // 3, winding.numpoints, plane_index, texture_index])
+                    for i in range(0, winding.numpoints):
+                        data['points'].extend(winding.points[i][:3])
+                        data['uvs'].extend(winding.points[i][3:5])
+                    num_polygons += 1
+
+            data['brushes'][-1] = num_polygons
+
+    offset = 0
+    for value in strings:
+        data['strings'].append(offset)
+        # On Python 2 the parsed strings already are bytes
+        encoded = value if isinstance(value, bytes) else value.encode('utf-8')
+        data['strdata'].extend(bytearray(encoded))
+        offset += len(encoded)
+    data['strings'].append(offset)
+
+    if sys.byteorder != 'little':
+        for name, type_code, _ in SECTIONS:
+            data[name].byteswap()
+
+    # Lay the sections out after the header and section table, aligned so they can be viewed in place
+    offset = HEADER.size + SECTION.size * len(SECTIONS)
+    table = []
+    for name, _, _ in SECTIONS:
+        offset = (offset + 7) & ~7
+        table.append((name, offset, len(data[name])))
+        offset += len(data[name]) * data[name].itemsize
+
+    with open(file_name, 'wb') as geometry_file:
+        geometry_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(SECTIONS)))
+        for name, section_offset, count in table:
+            geometry_file.write(SECTION.pack(name.encode('ascii'), section_offset, count))
+
+        for name, section_offset, _ in table:
+            geometry_file.write(b'\0' * (section_offset - geometry_file.tell()))
+            geometry_file.write(array_to_bytes(data[name]))
+
+
+class SectionView:
+    """
+    Flat read only view of the values of a section, each value is unpacked from the mapped file when it is indexed.
+    Used where a memoryview can't be cast over the file, on Python 2 and on big endian machines.
+    """
+    def __init__(self, mapping, offset, count, type_code):
+        self.mapping = mapping
+        self.offset = offset
+        self.count = count
+        self.value = struct.Struct('<' + type_code)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError('section index out of range')
+        return self.value.unpack_from(self.mapping, self.offset + index * self.value.size)[0]
+
+
+class GeometryFile:
+    """
+    A geometry file mapped into memory.
+    Every section is available as a flat view of its values straight on top of the mapped file,
+    nothing gets read until it is indexed, so opening even a huge map is instant.
+    """
+    def __init__(self, file_name):
+        self.file = open(file_name, 'rb')
+        self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.views = []
+
+        # memoryview.cast is Python 3 only, and the values are only usable in place on little endian machines
+        view = None
+        if hasattr(memoryview, 'cast') and sys.byteorder == 'little':
+            view = memoryview(self.mapping)
+            self.views.append(view)
+
+        magic, version, num_sections = HEADER.unpack_from(self.mapping, 0)
+        if magic != MAGIC:
+            raise Exception('{0} is not a geometry file'.format(file_name))
+        if version != FORMAT_VERSION:
+            raise Exception('{0} is geometry file version {1}, version {2} is required'.format(
+                file_name, version, FORMAT_VERSION))
+
+        type_codes = dict((name, type_code) for name, type_code, _ in SECTIONS)
+        self.offsets = {}
+        for i in range(0, num_sections):
+            name, offset, count = SECTION.unpack_from(self.mapping, HEADER.size + SECTION.size * i)
+            name = name.rstrip(b'\0').decode('ascii')
+            if name not in type_codes:
+                # Sections added by a later writer of the same version can be skipped
+                continue
+
+            type_code = type_codes[name]
+            self.offsets[name] = offset
+            if view is not None:
+                section = view[offset:offset + count * struct.calcsize(type_code)].cast(type_code)
+                self.views.append(section)
+            else:
+                section = SectionView(self.mapping, offset, count, type_code)
+            setattr(self, name, section)
+
+        for name, _, _ in SECTIONS:
+            if not hasattr(self, name):
+                raise Exception('{0} has no {1} section'.format(file_name, name))
+
+        self.num_entities = len(self.entities) // 4
+        self.num_brushes = len(self.brushes) // 4
+        self.num_polygons = len(self.polygons) // 4
+        self.num_textures = len(self.textures) // 3
+
+    def get_string(self, string_index):
+        offset = self.offsets['strdata']
+        value = self.mapping[offset + self.strings[string_index]:offset + self.strings[string_index + 1]]
+        # Python 2 keeps the bytes, like the strings of the parsed maps
+        if str is bytes:
+            return value
+        return value.decode('utf-8')
+
+    def get_entity_properties(self, entity_index):
+        """ The key / value pairs of an entity as a dictionary """
+        first = self.entities[entity_index * 4 + 2]
+        properties = {}
+        for i in range(first, first + self.entities[entity_index * 4 + 3]):
+            properties[self.get_string(self.properties[i * 2])] = self.get_string(self.properties[i * 2 + 1])
+        return properties
+
+    def close(self):
+        """ Releases the views and unmaps the file """
+        # The views made from the file view go first, the file view last
+        for section in reversed(self.views):
+            section.release()
+        self.views = []
+        for name, _, _ in SECTIONS:
+            if hasattr(self, name):
+                delattr(self, name)
+        self.mapping.close()
+        self.file.close()
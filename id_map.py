@@ -177,6 +177,88 @@ class IdMath:
 
         return neww
 
+    @staticmethod
+    def divide_winding(input_points, split):
+        """
+        Splits a winding in two by a plane, this is ClipWindingEpsilon from the Id tools
+        :return (front, back) windings, either of which is None if nothing of the winding is on that side
+        """
+        dists = [0 for _ in range(IdMath.MAX_POINTS_ON_WINDING)]
+        sides = [0 for _ in range(IdMath.MAX_POINTS_ON_WINDING)]
+        counts = [0, 0, 0]
+
+        # Id: determine sides for each point
+        for i in range(0, input_points.numpoints):
+            dot = IdMath.dot_product(input_points.points[i], split.normal)
+            dot -= split.dist
+            dists[i] = dot
+            if dot > IdMath.ON_EPSILON:
+                sides[i] = IdMath.SIDE_FRONT
+            elif dot < -IdMath.ON_EPSILON:
+                sides[i] = IdMath.SIDE_BACK
+            else:
+                sides[i] = IdMath.SIDE_ON
+
+            counts[sides[i]] += 1
+
+        sides[input_points.numpoints] = sides[0]
+        dists[input_points.numpoints] = dists[0]
+
+        # Nothing in front, all of it is behind, or the other way around
+        if counts[0] == 0:
+            return None, input_points
+        if counts[1] == 0:
+            return input_points, None
+
+        maxpts = input_points.numpoints + 4  # Id: can't use counts[0] + 2 because of fp grouping errors
+        front = Id2Map.Winding(maxpts)
+        back = Id2Map.Winding(maxpts)
+
+        for i in range(0, input_points.numpoints):
+            p1 = input_points.points[i]
+
+            # Points on the plane go to both sides
+            if sides[i] == IdMath.SIDE_ON:
+                IdMath.copy(p1, front.points[front.numpoints])
+                front.numpoints += 1
+                IdMath.copy(p1, back.points[back.numpoints])
+                back.numpoints += 1
+                continue
+
+            if sides[i] == IdMath.SIDE_FRONT:
+                IdMath.copy(p1, front.points[front.numpoints])
+                front.numpoints += 1
+            else:
+                IdMath.copy(p1, back.points[back.numpoints])
+                back.numpoints += 1
+
+            if sides[i + 1] == IdMath.SIDE_ON or sides[i + 1] == sides[i]:
+                continue
+
+            # Id: generate a split point
+            p2 = input_points.points[(i + 1) % input_points.numpoints]
+
+            dot = dists[i] / (dists[i] - dists[i + 1])
+            mid = [0.0, 0.0, 0.0]
+            for j in range(0, 3):
+                # Id: avoid round off error when possible
+                if split.normal[j] == 1.0:
+                    mid[j] = split.dist
+                elif split.normal[j] == -1.0:
+                    mid[j] = -split.dist
+                else:
+                    mid[j] = p1[j] + dot * (p2[j] - p1[j])
+
+            IdMath.copy(mid, front.points[front.numpoints])
+            front.numpoints += 1
+            IdMath.copy(mid, back.points[back.numpoints])
+            back.numpoints += 1
+
+        if front.numpoints > maxpts or back.numpoints > maxpts:
+            raise Exception('ClipWinding: points exceeded estimate')
+
+        return front, back
+
     baseaxis = [[0, 0, 1], [1, 0, 0], [0, -1, 0],			# floor
                 [0, 0, -1], [1, 0, 0], [0, -1, 0],		# ceiling
                 [1, 0, 0], [0, 1, 0], [0, 0, -1],			# west wall
@@ -308,36 +390,126 @@ class Id2Map:
     def __init__(self):
         self.entities = []
 
-    def parse_map_file(self, map_file_name, verbose=False, textures_path=None):
+    def parse_map_file(self, map_file_name, verbose=False, textures_path=None, cache=None):
         """
         Parses a map file
         :param map_file_name: The name of the file to parse
         :param verbose: Print out issues found
         :param textures_path: Path to lookup textures
+        :param cache: Optional GeometryCache to reuse unchanged entities and brushes from a previous parse
+        """
+        self.entities = []
+        for ent in self.iter_map_file(map_file_name, verbose, textures_path, cache):
+            # add to entities list
+            self.entities.append(ent)
+
+    def csg_entities(self):
+        """
+        Removes the parts of the brush faces which are buried inside of other brushes, following what the Quake 2
+        compiler clips against what. The world and its func_groups are clipped as one list of brushes in map file
+        order, every other entity is only clipped against itself.
+        Entities reused from a GeometryCache keep their CSG, the world is only redone if any of its brushes changed.
+        """
+        world_entities = [ent for ent in self.entities if ent.is_world()]
+        world_brushes = [brush for ent in world_entities for brush in ent.brushes]
+
+        for ent in world_entities:
+            # A world brush which was removed or moved around changes the CSG of the whole world
+            if not ent.csg_applied or ent.csg_world_brushes is None or \
+                    len(ent.csg_world_brushes) != len(world_brushes) or \
+                    any(a is not b for a, b in zip(ent.csg_world_brushes, world_brushes)):
+                Id2Map.Brush.csg_brushes(world_brushes)
+                for world_entity in world_entities:
+                    world_entity.csg_applied = True
+                    world_entity.csg_world_brushes = world_brushes
+                break
+
+        for ent in self.entities:
+            if not ent.is_world() and not ent.csg_applied:
+                ent.csg_brushes()
+
+    @staticmethod
+    def iter_map_file(map_file_name, verbose=False, textures_path=None, cache=None):
+        """
+        Parses a map file one entity at a time
+        Nothing is kept around once an entity has been yielded, so the caller decides how long
+        the brush geometry lives. Only the lines of the entity currently being parsed are in memory.
+        :param map_file_name: The name of the file to parse
+        :param verbose: Print out issues found
+        :param textures_path: Path to lookup textures
+        :param cache: Optional GeometryCache to reuse unchanged entities and brushes from a previous parse
         """
         # this is an optional path. If it is not supplied, the texture UVs are not generated.
         Id2Map.textures_path = textures_path
         Id2Map.verbose = verbose
-        self.entities = []
-        map_file = open(map_file_name, 'rb')
-        file_lines = map_file.readlines()
-        map_file.close()
+
+        if cache is not None:
+            cache.begin_pass(textures_path)
+
+        Id2Map.Brush.built_brushes = 0
+        Id2Map.Brush.axial_brushes = 0
 
         entity_lines = []
         struc_level = 0
-        for line in file_lines:
-            # add the line to the entity line list
-            entity_lines.append(line)
-            if line[0] == '{':
-                struc_level += 1
-            elif line[0] == '}':
-                struc_level -= 1
-                if struc_level == 0:
-                    # end of the entity, pass the lines to a new entity
-                    ent = Id2Map.Entity(entity_lines)
-                    # add to entities list
-                    self.entities.append(ent)
-                    entity_lines = []
+        with open(map_file_name, 'rb') as map_file:
+            for line in map_file:
+                # add the line to the entity line list
+                entity_lines.append(line)
+                if line[0] == '{':
+                    struc_level += 1
+                elif line[0] == '}':
+                    struc_level -= 1
+                    if struc_level == 0:
+                        # end of the entity, pass the lines to a new entity
+                        ent = Id2Map.Entity.from_lines(entity_lines, cache)
+                        entity_lines = []
+                        yield ent
+
+        if cache is not None:
+            cache.end_pass()
+
+    @staticmethod
+    def iter_map_brushes(map_file_name, verbose=False, textures_path=None):
+        """
+        Parses a map file one brush at a time
+        Only the lines of the brush being parsed and the properties of its entity are kept, so memory use does
+        not grow with the size of the map, not even for a worldspawn holding almost every brush.
+        The entity yielded with a brush has its properties but no brushes, the properties come before the
+        brushes in a map file so they are complete by the time the first brush of the entity is yielded.
+        Entities without brushes are skipped.
+        :param map_file_name: The name of the file to parse
+        :param verbose: Print out issues found
+        :param textures_path: Path to lookup textures
+        :return Generator of (entity, brush), all of the brushes of an entity come with the same entity
+        """
+        Id2Map.textures_path = textures_path
+        Id2Map.verbose = verbose
+
+        Id2Map.Brush.built_brushes = 0
+        Id2Map.Brush.axial_brushes = 0
+
+        ent = None
+        brush_lines = []
+        struc_level = 0  # 1 = in entity, 2 = in brush
+        with open(map_file_name, 'rb') as map_file:
+            for line in map_file:
+                if struc_level == 2 and line[0] != '}':
+                    brush_lines.append(line)
+                elif line[0] == '{':
+                    if struc_level == 0:
+                        ent = Id2Map.Entity([])
+                    else:
+                        brush_lines = []
+                    struc_level += 1
+                elif line[0] == '}':
+                    struc_level -= 1
+                    if struc_level == 1:
+                        # end of the brush, build it and hand it over right away
+                        brush = Id2Map.Brush.from_lines(brush_lines)
+                        brush_lines = []
+                        yield ent, brush
+                else:
+                    ent.parse_property(line)
 
     class Texture:
         texture_db = {}
@@ -353,6 +525,23 @@ class Id2Map:
         """
         Information about how the texture should be rendered on a surface
         """
+        # Quake 2 contents bits, what the brush is made of
+        CONTENTS_SOLID = 0x1
+        CONTENTS_WINDOW = 0x2
+        CONTENTS_LAVA = 0x8
+        CONTENTS_SLIME = 0x10
+        CONTENTS_WATER = 0x20
+        CONTENTS_MIST = 0x40
+        CONTENTS_PLAYERCLIP = 0x10000
+        CONTENTS_MONSTERCLIP = 0x20000
+        CONTENTS_ORIGIN = 0x1000000
+
+        # Quake 2 surface flags, how the face is drawn
+        SURF_SKY = 0x4
+        SURF_TRANS33 = 0x10
+        SURF_TRANS66 = 0x20
+        SURF_NODRAW = 0x80
+
         def __init__(self):
             self.name = ''
             self.shift = [0, 0]
@@ -363,14 +552,15 @@ class Id2Map:
             self.value = 0
 
         def setup_tex_def(self, tex_name, tex_params):
+            # Some editors write shift and rotate as decimals, and even the flags
             self.name = tex_name
-            self.shift = (int(tex_params[0]), int(tex_params[1]))
-            self.rotate = int(tex_params[2])
+            self.shift = (float(tex_params[0]), float(tex_params[1]))
+            self.rotate = float(tex_params[2])
             self.scale = (float(tex_params[3]), float(tex_params[4]))
             if len(tex_params) > 5:
-                self.contents = int(tex_params[5])
-                self.flags = int(tex_params[6])
-                self.value = int(tex_params[7])
+                self.contents = int(float(tex_params[5]))
+                self.flags = int(float(tex_params[6]))
+                self.value = int(float(tex_params[7]))
 
     class Plane:
         """
@@ -476,8 +666,17 @@ class Id2Map:
             self.texture = None
             self.plane = Id2Map.Plane()
             self.winding = None
+            self.csg_windings = None
             self.color = [0, 0, 0]
 
+        def visible_windings(self):
+            """ The polygons to export for the face, what CSG left of the winding, or the whole winding """
+            if self.csg_windings is not None:
+                return self.csg_windings
+            if self.winding is None:
+                return []
+            return [self.winding]
+
         def set_plane_point(self, point_index, vec_str):
             i = 0
             for var in vec_str.split(' '):
@@ -489,11 +688,45 @@ class Id2Map:
         """
         Brush Definition
         """
+        # How many brushes had their windings made since the last parse, and how many of those were axial
+        built_brushes = 0
+        axial_brushes = 0
+
+        # The corners of the base poly of an axial plane, as the signs of the two other axes in axis order.
+        # These are the corners Winding.base_poly_for_plane makes, in the same order, for a positive normal.
+        # A negative normal flips the right vector of the base poly, which is y for x and z planes and x for y planes.
+        axial_base_corners = [[(-1, 1), (1, 1), (1, -1), (-1, -1)],   # x plane: (y, z)
+                              [(1, 1), (-1, 1), (-1, -1), (1, -1)],   # y plane: (x, z)
+                              [(1, 1), (1, -1), (-1, -1), (-1, 1)]]   # z plane: (x, y)
+
         def __init__(self):
             self.mins = [99999.0, 99999.0, 99999.0]
             self.maxs = [-99999.0, -99999.0, -99999.0]
             self.faces = []
 
+        @staticmethod
+        def from_lines(brush_lines, cache=None):
+            """
+            Creates a brush and its face windings from the face lines of the brush
+            :param brush_lines: The face lines of the brush, without the enclosing braces
+            :param cache: Optional GeometryCache, the brush is only rebuilt if its lines changed since the last parse
+            """
+            key = None
+            if cache is not None:
+                key = tuple(brush_lines)
+                brush = cache.get_brush(key)
+                if brush is not None:
+                    return brush
+
+            brush = Id2Map.Brush()
+            for line in brush_lines:
+                brush.add_face(line)
+            brush.make_face_windings()
+
+            if cache is not None:
+                cache.add_brush(key, brush)
+            return brush
+
         def add_face(self, face_line):
             brush_plane_re = re.compile('\(\s([\s|\d|\-|.]+)\s\)\s'  # point 1
                                         '\(\s([\s|\d|\-|.]+)\s\)\s'  # point 2
@@ -512,6 +745,10 @@ class Id2Map:
                 # create the plane from the points
                 face.plane.set_plane(face.planepts)
 
+                # Setup the texture
+                face.texdef = Id2Map.TexDef()
+                face.texdef.setup_tex_def(groups[3], groups[4].split())
+
                 # If the texture directory was supplied, find the texture to get some important
                 if Id2Map.textures_path is not None:
                     texture_path = os.path.join(Id2Map.textures_path, groups[3])
@@ -527,10 +764,6 @@ class Id2Map:
                             face.texture = Id2Map.Texture(im.size[0], im.size[1], texture_path)
                             fp.close()
                             Id2Map.Texture.texture_db[texture_path] = face.texture
-
-                        # Setup the texture
-                        face.texdef = Id2Map.TexDef()
-                        face.texdef.setup_tex_def(groups[3], groups[4].split(' '))
                     elif groups[3] != 'portal':
                         raise Exception('Unable to find texture {0}'.format(texture_path))
 
@@ -541,8 +774,16 @@ class Id2Map:
 
         def make_face_windings(self):
             """ creates the visible polygons on the faces """
+            axial = self.is_axial()
+            Id2Map.Brush.built_brushes += 1
+            if axial:
+                Id2Map.Brush.axial_brushes += 1
+
             for face in self.faces:
-                face.winding = self.make_face_winding(face)
+                if axial:
+                    face.winding = self.make_axial_face_winding(face)
+                else:
+                    face.winding = self.make_face_winding(face)
                 if face.winding is None:
                     continue
 
@@ -611,47 +852,362 @@ class Id2Map:
 
             return w
 
+        @staticmethod
+        def get_plane_axis(plane):
+            """ The axis the plane faces along, or -1 if the plane is not axial """
+            for i in range(0, 3):
+                if math.fabs(plane.normal[i]) == 1.0:
+                    return i
+            return -1
+
+        def is_axial(self):
+            """
+            If all of the planes of the brush are axial, which makes the brush a box and lets the windings be made
+            without clipping a huge polygon. Brushes with the same plane twice go the general way, which reports them.
+            """
+            planes = set()
+            for face in self.faces:
+                axis = Id2Map.Brush.get_plane_axis(face.plane)
+                if axis == -1:
+                    return False
+
+                plane_key = (axis, face.plane.normal[axis], int(math.floor(face.plane.dist / 0.01 + 0.5)))
+                if plane_key in planes:
+                    return False
+                planes.add(plane_key)
+
+            return True
+
+        def make_axial_face_winding(self, face):
+            """
+            Creates the visible polygon for a face of a brush with only axial planes.
+            Does the same as make_face_winding, but knowing that the polygon stays an axis aligned rectangle while
+            it is being clipped. Each clip either keeps the rectangle, removes it, or moves one of its edges onto
+            the clipping plane, so only the four corners have to be tracked. The corners come out in the same
+            order and with the same values as the general path gives.
+            """
+            axis = Id2Map.Brush.get_plane_axis(face.plane)
+            sign = face.plane.normal[axis]
+            u = 1 if axis == 0 else 0
+            v = 1 if axis == 2 else 2
+
+            # The corners of the base poly
+            corners = []
+            for corner_u, corner_v in Id2Map.Brush.axial_base_corners[axis]:
+                point = [0.0, 0.0, 0.0]
+                point[axis] = sign * face.plane.dist
+                if axis == 2:
+                    point[u] = 8192.0 * corner_u
+                    point[v] = 8192.0 * corner_v * sign
+                else:
+                    point[u] = 8192.0 * corner_u * sign
+                    point[v] = 8192.0 * corner_v
+                corners.append(point)
+
+            for clip in self.faces:
+                if clip == face:
+                    continue
+
+                # we keep the back side of the clipping plane, the point coordinate along the clip axis decides
+                clip_axis = Id2Map.Brush.get_plane_axis(clip.plane)
+                clip_sign = clip.plane.normal[clip_axis]
+                sides = []
+                for point in corners:
+                    dot = -clip_sign * point[clip_axis] + clip.plane.dist
+                    if dot > IdMath.ON_EPSILON:
+                        sides.append(IdMath.SIDE_FRONT)
+                    elif dot < -IdMath.ON_EPSILON:
+                        sides.append(IdMath.SIDE_BACK)
+                    else:
+                        sides.append(IdMath.SIDE_ON)
+
+                if IdMath.SIDE_FRONT not in sides:
+                    return None
+                if IdMath.SIDE_BACK not in sides:
+                    continue
+
+                # The clip crosses the rectangle, the corners behind the plane slide onto it
+                for i in range(0, 4):
+                    if sides[i] == IdMath.SIDE_BACK:
+                        corners[i][clip_axis] = clip_sign * clip.plane.dist
+
+                # The clipped polygon starts from the first point in front of the plane, or from the split
+                # point leading to it. That is only a different corner if the first two corners were behind.
+                if sides[0] == IdMath.SIDE_BACK and sides[1] == IdMath.SIDE_BACK:
+                    corners = corners[1:] + corners[:1]
+
+            w = Id2Map.Winding(4)
+            w.numpoints = 4
+            for i in range(0, 4):
+                IdMath.copy(corners[i], w.points[i])
+
+            return w
+
+        def get_contents(self):
+            """ The contents of the brush, like the Id tools this comes from the first face, no contents is solid """
+            if len(self.faces) == 0 or self.faces[0].texdef is None or self.faces[0].texdef.contents == 0:
+                return Id2Map.TexDef.CONTENTS_SOLID
+            return self.faces[0].texdef.contents
+
+        def is_opaque(self):
+            """ If the brush blocks the view, and so hides the faces of other brushes which are inside of it """
+            if not self.get_contents() & Id2Map.TexDef.CONTENTS_SOLID:
+                return False
+
+            see_through = Id2Map.TexDef.SURF_TRANS33 | Id2Map.TexDef.SURF_TRANS66 | Id2Map.TexDef.SURF_NODRAW
+            for face in self.faces:
+                if face.texdef is not None and face.texdef.flags & see_through:
+                    return False
+
+            return True
+
+        def overlaps(self, other):
+            """ If the bounds of the two brushes overlap or touch """
+            for i in range(0, 3):
+                if self.mins[i] > other.maxs[i] + IdMath.ON_EPSILON or self.maxs[i] < other.mins[i] - IdMath.ON_EPSILON:
+                    return False
+            return True
+
+        def clip_outside(self, face, windings, precedence):
+            """
+            Clips pieces of a face of another brush against the volume of this brush, this is ClipInside from the
+            Quake CSG code run with every plane of this brush
+            :param face: The face of the other brush the windings are on
+            :param windings: The pieces of the face to clip
+            :param precedence: If this brush wins when one of its faces is on the same plane as the other face,
+                               which is the case when this brush comes later in the map file
+            :return The pieces of the windings which are outside of this brush
+            """
+            outside = []
+            inside = windings
+            for clip in self.faces:
+                dot = IdMath.dot_product(face.plane.normal, clip.plane.normal)
+                next_inside = []
+                for w in inside:
+                    if dot > 0.999 and math.fabs(face.plane.dist - clip.plane.dist) < 0.01:
+                        # Id: exactly on, faces facing the same way are only removed if the clipping brush wins
+                        if precedence:
+                            next_inside.append(w)
+                        else:
+                            outside.append(w)
+                    elif dot < -0.999 and math.fabs(face.plane.dist + clip.plane.dist) < 0.01:
+                        # Id: always clip off opposite facing
+                        next_inside.append(w)
+                    else:
+                        front, back = IdMath.divide_winding(w, clip.plane)
+                        if front is not None:
+                            outside.append(front)
+                        if back is not None:
+                            next_inside.append(back)
+
+                inside = next_inside
+                if len(inside) == 0:
+                    break
+
+            # Whatever is still inside is behind all of the planes, and so buried in the brush
+            return outside
+
+        @staticmethod
+        def csg_brushes(brushes):
+            """
+            Removes the parts of the brush faces which are buried inside of other brushes of the list.
+            This follows the Quake compiler CSG, every face is clipped by every opaque brush it touches, and
+            when two faces are on the same plane the face of the brush later in the map file is kept.
+            The pieces that are left of each face end up in the csg_windings of the face.
+            :param brushes: The brushes to clip against each other, in map file order
+            """
+            # Sort the brushes along x so only brushes which can overlap get tested against each other
+            order = sorted(range(0, len(brushes)), key=lambda k: brushes[k].mins[0])
+            touching = [[] for _ in brushes]
+            for i in range(0, len(order)):
+                brush = brushes[order[i]]
+                for j in range(i + 1, len(order)):
+                    other = brushes[order[j]]
+                    if other.mins[0] > brush.maxs[0] + IdMath.ON_EPSILON:
+                        break
+                    if brush.overlaps(other):
+                        touching[order[i]].append(order[j])
+                        touching[order[j]].append(order[i])
+
+            for i in range(0, len(brushes)):
+                brush = brushes[i]
+                # Keep the map file order, which decides what wins for faces on the same plane
+                clippers = [k for k in sorted(touching[i]) if brushes[k].is_opaque()]
+
+                for face in brush.faces:
+                    face.csg_windings = None
+                    if face.winding is None:
+                        continue
+
+                    windings = [face.winding]
+                    for k in clippers:
+                        windings = brushes[k].clip_outside(face, windings, k > i)
+                        if len(windings) == 0:
+                            break
+
+                    face.csg_windings = []
+                    for w in windings:
+                        if w.numpoints < 3:
+                            continue
+
+                        # The new pieces only got their positions, the UVs have to be generated again
+                        if w is not face.winding and face.texdef is not None and face.texture is not None:
+                            for p in range(0, w.numpoints):
+                                IdMath.emit_texture_coordinates(w.points[p], face.texture, face)
+                        face.csg_windings.append(w)
+
     class Entity:
         """
         Entity key / value pairs and brush data
         """
-        def __init__(self, entity_lines):
+        # The Quake 2 compiler folds func_group brushes into the world before CSG, they are only for the editor
+        WORLD_CLASSNAMES = ('worldspawn', 'func_group')
+
+        param_re = re.compile('\"([\w|\d|\s|!|#-/|:-@|[-`|{-~]+)\"\s+\"([\w|\d|\s|!|#-/|:-@|[-`|{-~]*)\"')
+
+        def __init__(self, entity_lines, cache=None):
             self.brushes = []
             self.properties = {}
-            self.parse_entity(entity_lines)
+            self.csg_applied = False
+            self.csg_world_brushes = None  # all of the world brushes, if the entity went through CSG as part of it
+            self.parse_entity(entity_lines, cache)
 
-        def parse_entity(self, entity_lines):
+        @staticmethod
+        def from_lines(entity_lines, cache=None):
+            """
+            Creates an entity from its map file lines, reusing the previously parsed entity if the lines are unchanged
+            :param entity_lines: The lines of the entity, including the enclosing braces
+            :param cache: Optional GeometryCache holding the results of the previous parse
+            """
+            if cache is None:
+                return Id2Map.Entity(entity_lines)
+
+            key = tuple(entity_lines)
+            ent = cache.get_entity(key)
+            if ent is None:
+                ent = Id2Map.Entity(entity_lines, cache)
+                cache.add_entity(key, ent)
+            return ent
+
+        def is_world(self):
+            """ If the brushes of the entity are part of the world when compiling the map """
+            return self.properties.get('classname', '') in Id2Map.Entity.WORLD_CLASSNAMES
+
+        def csg_brushes(self):
+            """ Removes the parts of the brush faces which are buried inside of other brushes of the entity """
+            Id2Map.Brush.csg_brushes(self.brushes)
+            self.csg_applied = True
+
+        def parse_entity(self, entity_lines, cache=None):
             struc_level = 0  # 1 = in entity, 2 = in brush
-            param_re = re.compile('\"([\w|\d|\s|!|#-/|:-@|[-`|{-~]+)\"\s+\"([\w|\d|\s|!|#-/|:-@|[-`|{-~]*)\"')
+            brush_lines = []
 
             for line in entity_lines:
                 if struc_level == 2 and line[0] != '}':
-                    cur_brush = self.brushes[len(self.brushes) - 1]
-                    cur_brush.add_face(line)
+                    brush_lines.append(line)
                 elif line[0] == '{':
                     if struc_level == 1:
-                        self.brushes.append(Id2Map.Brush())
+                        brush_lines = []
                     struc_level += 1
                 elif line[0] == '}':
                     if struc_level == 2:
                         # Finished parsing brush, create the visible polygons from the planes
-                        cur_brush = self.brushes[len(self.brushes) - 1]
-                        cur_brush.make_face_windings()
+                        self.brushes.append(Id2Map.Brush.from_lines(brush_lines, cache))
                     struc_level -= 1
                 else:
-                    # Check for a comment line
-                    num_forward_slashes = 0
-                    for i in range(0, 2):
-                        if line[i] == '/':
-                            num_forward_slashes += 1
-
-                    if num_forward_slashes != 2:
-                        # A parameter line, put it in the dictionary
-                        match = param_re.match(line)
-                        if match is not None:
-                            groups = match.groups()
-                            self.properties[groups[0]] = groups[1]
-                        else:
-                            raise Exception('WARNING: Could not parse property line {0}'.format(line))
-                    elif Id2Map.verbose:
-                        print(line)
+                    self.parse_property(line)
+
+        def parse_property(self, line):
+            """ Parses a key / value line of the entity, or skips it if it is a comment """
+            # Check for a comment line
+            num_forward_slashes = 0
+            for i in range(0, 2):
+                if line[i] == '/':
+                    num_forward_slashes += 1
+
+            if num_forward_slashes != 2:
+                # A parameter line, put it in the dictionary
+                match = Id2Map.Entity.param_re.match(line)
+                if match is not None:
+                    groups = match.groups()
+                    self.properties[groups[0]] = groups[1]
+                else:
+                    raise Exception('WARNING: Could not parse property line {0}'.format(line))
+            elif Id2Map.verbose:
+                print(line)
+
+    class GeometryCache:
+        """
+        Keeps parsed entities and brushes around between parses of the same map file.
+        Entities and brushes are keyed by the exact text they were parsed from, so anything which was
+        not touched since the last parse is reused as is instead of having its windings rebuilt.
+        Anything that was not seen during the last parse is dropped when the parse finishes.
+        """
+        def __init__(self):
+            self.textures_path = None
+            self.entities = {}
+            self.entity_brush_keys = {}
+            self.brushes = {}
+            self.pending_brush_keys = []
+            self.used_entities = set()
+            self.used_brushes = set()
+            self.brushes_reused = 0
+            self.brushes_built = 0
+
+        def begin_pass(self, textures_path):
+            """ Called before a map file is parsed using this cache """
+            if textures_path != self.textures_path:
+                # The texture sizes go into the UVs, none of the cached geometry is valid anymore
+                self.entities = {}
+                self.entity_brush_keys = {}
+                self.brushes = {}
+                self.textures_path = textures_path
+
+            self.used_entities = set()
+            self.used_brushes = set()
+            self.brushes_reused = 0
+            self.brushes_built = 0
+
+        def end_pass(self):
+            """ Called once the whole map file was parsed, forgets everything that is no longer in the map """
+            self.entities = dict((key, self.entities[key]) for key in self.used_entities)
+            self.entity_brush_keys = dict((key, self.entity_brush_keys[key]) for key in self.used_entities)
+            self.brushes = dict((key, self.brushes[key]) for key in self.used_brushes)
+
+        def get_entity(self, key):
+            # The same entity text can show up twice in a map, each copy needs its own entity.
+            # The same goes for its brushes, one of them might already be in use by an entity parsed earlier.
+            if key in self.used_entities or key not in self.entities or \
+                    not self.used_brushes.isdisjoint(self.entity_brush_keys[key]):
+                # The entity is about to be parsed, start collecting the brushes that belong to it
+                self.pending_brush_keys = []
+                return None
+
+            self.used_entities.add(key)
+            ent = self.entities[key]
+            self.brushes_reused += len(ent.brushes)
+            # keep the brushes of the entity cached in case the entity changes later on
+            self.used_brushes.update(self.entity_brush_keys[key])
+            return ent
+
+        def add_entity(self, key, ent):
+            self.used_entities.add(key)
+            self.entities[key] = ent
+            self.entity_brush_keys[key] = self.pending_brush_keys
+            self.pending_brush_keys = []
+
+        def get_brush(self, key):
+            # Duplicated brushes get their own brush so later stages can modify them independently
+            if key in self.used_brushes or key not in self.brushes:
+                return None
+
+            self.used_brushes.add(key)
+            self.pending_brush_keys.append(key)
+            self.brushes_reused += 1
+            return self.brushes[key]
+
+        def add_brush(self, key, brush):
+            self.used_brushes.add(key)
+            self.pending_brush_keys.append(key)
+            self.brushes[key] = brush
+            self.brushes_built += 1
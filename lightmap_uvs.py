@@ -0,0 +1,142 @@
+import math
+import id_map
+import texture_atlas
+
+__author__ = 'Ryan Sheffer'
+
+
+def get_plane_axes(normal):
+    """
+    Two unit vectors spanning a plane, made the same way as the base poly of the plane so there is no stretching
+    :return (right, up)
+    """
+    plane = id_map.Id2Map.Plane()
+    plane.normal = list(normal)
+    w = id_map.Id2Map.Winding.base_poly_for_plane(plane)
+
+    # The base poly is a square of the plane, its edges are along the axes
+    right = [0.0, 0.0, 0.0]
+    up = [0.0, 0.0, 0.0]
+    id_map.IdMath.subtract(w.points[1], w.points[0], right)
+    id_map.IdMath.subtract(w.points[0], w.points[3], up)
+    id_map.IdMath.normalize(right)
+    id_map.IdMath.normalize(up)
+    return right, up
+
+
+def get_mesh_polygons(brush):
+    """
+    Collects the polygons of a brush mesh as plain data, which is what gets sent to the worker processes
+    :return List of (face index, plane normal, list of (x, y, z)), in the order the polygons are exported
+    """
+    polygons = []
+    for face_index in range(0, len(brush.faces)):
+        face = brush.faces[face_index]
+        for winding in face.visible_windings():
+            points = [tuple(winding.points[i][:3]) for i in range(0, winding.numpoints)]
+            polygons.append((face_index, tuple(face.plane.normal), points))
+
+    return polygons
+
+
+def make_charts(polygons):
+    """
+    Groups the polygons into charts, polygons on the same face which share an edge end up in the same chart
+    :return List of charts, each a list of polygon indices
+    """
+    parents = list(range(0, len(polygons)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    # An edge is the pair of rounded points, in either direction
+    edge_owners = {}
+    for poly_index in range(0, len(polygons)):
+        face_index, _, points = polygons[poly_index]
+        rounded = [tuple(round(v, 2) for v in point) for point in points]
+        for i in range(0, len(rounded)):
+            edge = (face_index, min(rounded[i], rounded[i - 1]), max(rounded[i], rounded[i - 1]))
+            if edge in edge_owners:
+                parents[find(poly_index)] = find(edge_owners[edge])
+            else:
+                edge_owners[edge] = poly_index
+
+    charts = {}
+    for poly_index in range(0, len(polygons)):
+        charts.setdefault(find(poly_index), []).append(poly_index)
+
+    return [charts[root] for root in sorted(charts.keys())]
+
+
+def compute_lightmap_uvs(job):
+    """
+    Unwraps the polygons of a mesh into non overlapping charts packed into the [0, 1] square.
+    Runs in the worker processes, so it only takes and returns plain data.
+    :param job: (polygons from get_mesh_polygons, texels per map unit, padding texels around each chart)
+    :return (width and height in texels the charts were packed into, list with a list of (u, v) for each polygon)
+    """
+    polygons, density, padding = job
+
+    # Project each chart onto its plane, in texels
+    chart_points = []
+    chart_sizes = []
+    charts = make_charts(polygons)
+    for chart in charts:
+        right, up = get_plane_axes(polygons[chart[0]][1])
+        projected = []
+        for poly_index in chart:
+            projected.append([(id_map.IdMath.dot_product(point, right) * density,
+                               id_map.IdMath.dot_product(point, up) * density)
+                              for point in polygons[poly_index][2]])
+
+        min_s = min(s for points in projected for s, _ in points)
+        min_t = min(t for points in projected for _, t in points)
+        max_s = max(s for points in projected for s, _ in points)
+        max_t = max(t for points in projected for _, t in points)
+        chart_points.append([[(s - min_s + padding, t - min_t + padding) for s, t in points] for points in projected])
+        chart_sizes.append((max(1, int(math.ceil(max_s - min_s)) + padding * 2),
+                            max(1, int(math.ceil(max_t - min_t)) + padding * 2)))
+
+    # Start from the smallest square that could hold the charts and grow it until they fit
+    area = sum(width * height for width, height in chart_sizes)
+    size = texture_atlas.next_power_of_two(max([int(math.sqrt(area))] + [max(s) for s in chart_sizes]))
+    while True:
+        packer = texture_atlas.SkylinePacker(size, size)
+        order = sorted(range(0, len(charts)), key=lambda k: chart_sizes[k][1], reverse=True)
+        positions = [None for _ in charts]
+        for chart_index in order:
+            positions[chart_index] = packer.insert(chart_sizes[chart_index][0], chart_sizes[chart_index][1])
+            if positions[chart_index] is None:
+                break
+        else:
+            break
+        size *= 2
+
+    uvs = [None for _ in polygons]
+    for chart_index in range(0, len(charts)):
+        x, y = positions[chart_index]
+        for i in range(0, len(charts[chart_index])):
+            uvs[charts[chart_index][i]] = [((x + s) / float(size), (y + t) / float(size))
+                                           for s, t in chart_points[chart_index][i]]
+
+    return size, uvs
+
+
+def generate_lightmap_uvs(brushes, density, padding, pool=None):
+    """
+    Generates a lightmap UV set for each brush mesh
+    :param brushes: The brushes to generate the UVs of, each brush is exported as a mesh
+    :param density: Lightmap texels per map unit
+    :param padding: Texels left empty around each chart so the lighting does not bleed
+    :param pool: Optional multiprocessing pool to spread the meshes over
+    :return List, for each brush, of the lightmap resolution the brush needs for its UVs to keep the density and
+            padding, and a list of (u, v) per point of each polygon in export order
+    """
+    jobs = [(get_mesh_polygons(brush), density, padding) for brush in brushes]
+    if pool is None:
+        return [compute_lightmap_uvs(job) for job in jobs]
+
+    return pool.map(compute_lightmap_uvs, jobs, max(1, len(jobs) // 64))
@@ -1,77 +1,276 @@
 import optparse
+import os
+import sys
+import time
 import fbx
+import multiprocessing
+import collision_hulls
+import geometry_file
 import id_map
+import lightmap_uvs
+import texture_atlas
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory reporting is skipped there
+    resource = None
 
 __author__ = 'Ryan'
 
 
-def add_entity_to_scene(scene, entity, brush_index):
+def get_face_uvs(face, winding, atlas=None):
+    """
+    Obtain the texture and texture coordinates to export for a polygon of a face
+    :param face: The face the polygon belongs to
+    :param winding: The polygon to get the UVs of
+    :param atlas: Optional TextureAtlas the face texture might have been packed into
+    :return (texture, list of (s, t) per winding point)
+    """
+    if atlas is not None:
+        remapped = atlas.remap_face(face, winding)
+        if remapped is not None:
+            return remapped
+
+    # Quake t runs down the texture, FBX v runs up it
+    uvs = []
+    for i in range(0, winding.numpoints):
+        point = winding.points[i]
+        uvs.append((point[3], 1.0 - point[4]))
+
+    return face.texture, uvs
+
+
+def get_material(scene, texture, materials):
+    """
+    Obtain the material showing a texture, materials are shared by all of the nodes of the scene
+    :param scene: The scene the material belongs to
+    :param texture: The texture of the material, None for faces without a texture
+    :param materials: Dictionary of the materials created so far, keyed by texture path
+    """
+    texture_path = texture.texture_path if texture is not None else None
+    if texture_path in materials:
+        return materials[texture_path]
+
+    if texture is None:
+        material = fbx.FbxSurfaceLambert.Create(scene, 'untextured')
+    else:
+        material_name = os.path.splitext(os.path.basename(texture_path))[0]
+        material = fbx.FbxSurfaceLambert.Create(scene, material_name)
+        file_texture = fbx.FbxFileTexture.Create(scene, material_name)
+        file_texture.SetFileName(texture_path)
+        file_texture.SetMappingType(fbx.FbxTexture.eUV)
+        file_texture.UVSet.Set(fbx.FbxString('diffuseUV'))
+        material.Diffuse.ConnectSrcObject(file_texture)
+
+    materials[texture_path] = material
+    return material
+
+
+def add_brush_mesh(scene, brush_index, points, uvs, polygons, materials, lightmap_uvs=None, lightmap_resolution=None):
+    """
+    Adds the mesh of a brush as a scene node, the polygons are made of the points one after the other
+    :param scene: The scene to add the brush to
+    :param brush_index: The brush index, this should be a unique ID per brush
+    :param points: The (x, y, z) of the points of all of the polygons
+    :param uvs: The diffuse (u, v) of each point
+    :param polygons: The (texture, number of points) of each polygon, the texture is None for untextured polygons
+    :param materials: Dictionary of the materials already in the scene, keyed by texture path
+    :param lightmap_uvs: Optional lightmap UVs of the brush, a list of (u, v) per polygon
+    :param lightmap_resolution: The lightmap width and height in texels the lightmap UVs were packed for
+    """
+    # Create a new node in the scene.
+    new_node = fbx.FbxNode.Create(scene, 'brushNode{0}'.format(brush_index))
+    scene.GetRootNode().AddChild(new_node)
+
+    # Create a new mesh node attribute in the scene, and set it as the new node's attribute
+    new_mesh = fbx.FbxMesh.Create(scene, 'brushMesh{0}'.format(brush_index))
+    new_node.SetNodeAttribute(new_mesh)
+
+    # init the control points we are going to set
+    new_mesh.InitControlPoints(len(points))
+
+    # set all control points
+    for i in range(0, len(points)):
+        new_mesh.SetControlPointAt(fbx.FbxVector4(points[i][0], points[i][1], points[i][2]), i)
+
+    # Faces never share points, so the UVs can be mapped directly to the control points.
+    # The diffuse UVs are always made, even without textures, so the lightmap UVs are always the second set.
+    uv_element = new_mesh.CreateElementUV('diffuseUV')
+    uv_element.SetMappingMode(fbx.FbxLayerElement.eByControlPoint)
+    uv_element.SetReferenceMode(fbx.FbxLayerElement.eDirect)
+    for uv in uvs:
+        uv_element.GetDirectArray().Add(fbx.FbxVector2(uv[0], uv[1]))
+
+    # Without textures there is nothing to map, the materials are only made when the textures are known
+    face_materials = None
+    if any(texture is not None for texture, _ in polygons):
+        material_element = new_mesh.CreateElementMaterial()
+        material_element.SetMappingMode(fbx.FbxLayerElement.eByPolygon)
+        material_element.SetReferenceMode(fbx.FbxLayerElement.eIndexToDirect)
+
+        # Materials are indexed per node, find the node index of each scene material used by the brush
+        node_material_indices = {}
+        face_materials = []
+        for texture, _ in polygons:
+            texture_path = texture.texture_path if texture is not None else None
+            if texture_path not in node_material_indices:
+                material = get_material(scene, texture, materials)
+                node_material_indices[texture_path] = new_node.AddMaterial(material)
+            face_materials.append(node_material_indices[texture_path])
+
+    if lightmap_uvs is not None:
+        # The lightmap UVs are a second UV set, one chart per group of connected polygons on the same plane
+        lightmap_element = new_mesh.CreateElementUV('lightmapUV')
+        lightmap_element.SetMappingMode(fbx.FbxLayerElement.eByControlPoint)
+        lightmap_element.SetReferenceMode(fbx.FbxLayerElement.eDirect)
+        for polygon_uvs in lightmap_uvs:
+            for uv in polygon_uvs:
+                lightmap_element.GetDirectArray().Add(fbx.FbxVector2(uv[0], uv[1]))
+
+        # The charts are only density and padding texels apart at this resolution, the engine has to bake at it
+        resolution_property = fbx.FbxProperty.Create(new_node, fbx.FbxIntDT, 'lightmapResolution')
+        resolution_property.ModifyFlag(fbx.FbxPropertyFlags.eUserDefined, True)
+        resolution_property.Set(lightmap_resolution)
+
+    # now join all the points
+    cur_point = 0
+    for cur_poly in range(0, len(polygons)):
+        if face_materials is not None:
+            new_mesh.BeginPolygon(face_materials[cur_poly])
+        else:
+            new_mesh.BeginPolygon(cur_poly)
+
+        for i in range(0, polygons[cur_poly][1]):
+            new_mesh.AddPolygon(cur_point)
+            cur_point += 1
+
+        new_mesh.EndPolygon()
+
+    if cur_point != len(points):
+        raise Exception('Number of points plotted on polygons not the number of actual polys!')
+
+
+def add_entity_to_scene(scene, entity, brush_index, materials=None, atlas=None, lightmap_uvs=None):
     """
     Adds a brush as a scene node
     :param scene: The scene to add the brushes to
     :param entity: The entity to take the brushes from
     :param brush_index: The brush index, this should be a unique ID per brush
+    :param materials: Dictionary of the materials already in the scene, keyed by texture path
+    :param atlas: Optional TextureAtlas to take the textures and UVs of the faces from
+    :param lightmap_uvs: Optional lightmap UVs of each brush of the entity, from generate_lightmap_uvs
     :return The number of brushes added
     """
+    if materials is None:
+        materials = {}
 
-    # Obtain a reference to the scene's root node.
-    root_node = scene.GetRootNode()
-
-    for brush in entity.brushes:
+    for entity_brush_index in range(0, len(entity.brushes)):
+        brush = entity.brushes[entity_brush_index]
 
         # ignore requested brushes with certain textures applied
         # if brush.faces[0].texture is not None and 'Vienna/DKwall03_5_v' in brush.faces[0].texture.texture_path:
         #    continue
 
-        # Create a new node in the scene.
-        new_node = fbx.FbxNode.Create(scene, 'brushNode{0}'.format(brush_index))
-        root_node.AddChild(new_node)
+        # accumulate all of the brush face points, their texture coordinates and the texture of each face
+        brush_points = []
+        brush_uvs = []
+        brush_polygons = []
+        for face in brush.faces:
+            # Not all faces work out, this is just some quake quirk or something.
+            # Faces cut up by CSG can also have several polygons.
+            for winding in face.visible_windings():
+                texture, uvs = get_face_uvs(face, winding, atlas)
+                brush_polygons.append((texture, winding.numpoints))
+
+                for i in range(0, winding.numpoints):
+                    brush_points.append(winding.points[i][:3])
+                    brush_uvs.append(uvs[i])
+
+        brush_lightmap_uvs = None
+        lightmap_resolution = None
+        if lightmap_uvs is not None:
+            lightmap_resolution, brush_lightmap_uvs = lightmap_uvs[entity_brush_index]
+        add_brush_mesh(scene, brush_index, brush_points, brush_uvs, brush_polygons, materials, brush_lightmap_uvs,
+                       lightmap_resolution)
+        brush_index += 1
 
-        # Create a new mesh node attribute in the scene, and set it as the new node's attribute
-        new_mesh = fbx.FbxMesh.Create(scene, 'brushMesh{0}'.format(brush_index))
-        new_node.SetNodeAttribute(new_mesh)
+    return len(entity.brushes)
+
+
+def add_geometry_to_scene(scene, geometry, materials=None):
+    """
+    Adds the brushes of a geometry file as scene nodes, the same nodes add_entity_to_scene makes
+    :param scene: The scene to add the brushes to
+    :param geometry: The GeometryFile to take the brushes from
+    :param materials: Dictionary of the materials already in the scene, keyed by texture path
+    :return The number of brushes added
+    """
+    if materials is None:
+        materials = {}
+
+    textures = []
+    for i in range(0, geometry.num_textures):
+        texture_path = geometry.get_string(geometry.textures[i * 3])
+        textures.append(id_map.Id2Map.Texture(geometry.textures[i * 3 + 1], geometry.textures[i * 3 + 2],
+                                              texture_path))
+
+    for brush_index in range(0, geometry.num_brushes):
+        first_polygon = geometry.brushes[brush_index * 4 + 2]
+        num_polygons = geometry.brushes[brush_index * 4 + 3]
 
-        # accumulate all of the brush face points
         brush_points = []
-        for face in brush.faces:
-            if face.winding is None:
-                # Not all faces work out, this is just some quake quirk or something
-                continue
+        brush_uvs = []
+        brush_polygons = []
+        for polygon_index in range(first_polygon, first_polygon + num_polygons):
+            first_point = geometry.polygons[polygon_index * 4]
+            num_points = geometry.polygons[polygon_index * 4 + 1]
+            texture_index = geometry.polygons[polygon_index * 4 + 3]
+            brush_polygons.append((textures[texture_index] if texture_index != -1 else None, num_points))
 
-            for i in range(0, face.winding.numpoints):
-                point = face.winding.points[i]
-                brush_points.append(fbx.FbxVector4(point[0], point[1], point[2]))
+            for point_index in range(first_point, first_point + num_points):
+                brush_points.append((geometry.points[point_index * 3], geometry.points[point_index * 3 + 1],
+                                     geometry.points[point_index * 3 + 2]))
+                # Quake t runs down the texture, FBX v runs up it
+                brush_uvs.append((geometry.uvs[point_index * 2], 1.0 - geometry.uvs[point_index * 2 + 1]))
 
-        # init the control points we are going to set
-        new_mesh.InitControlPoints(len(brush_points))
+        add_brush_mesh(scene, brush_index, brush_points, brush_uvs, brush_polygons, materials)
 
-        # set all control points
-        for i in range(0, len(brush_points)):
-            new_mesh.SetControlPointAt(brush_points[i], i)
+    return geometry.num_brushes
 
-        # now join all the points
-        cur_poly = 0
-        cur_point = 0
-        for face in brush.faces:
-            if face.winding is None:
-                # Not all faces work out, this is just some quake quirk or something
-                continue
 
-            new_mesh.BeginPolygon(cur_poly)
+def add_collision_hulls_to_scene(scene, hulls):
+    """
+    Adds the collision hulls as UCX_ nodes, which engines pick up as convex colliders of a mesh.
+    Each hull is named after the brush node it collides for, UCX_brushNode{N}_{NN}.
+    :param scene: The scene to add the hulls to
+    :param hulls: List of CollisionHull
+    """
+    root_node = scene.GetRootNode()
 
-            for i in range(0, face.winding.numpoints):
-                new_mesh.AddPolygon(cur_point)
-                cur_point += 1
+    brush_hull_counts = {}
+    for hull in hulls:
+        hull_index = brush_hull_counts.get(hull.brush_index, 0)
+        brush_hull_counts[hull.brush_index] = hull_index + 1
+        node_name = 'UCX_brushNode{0}_{1:02d}'.format(hull.brush_index, hull_index)
 
-            new_mesh.EndPolygon()
-            cur_poly += 1
+        new_node = fbx.FbxNode.Create(scene, node_name)
+        root_node.AddChild(new_node)
 
-        if cur_point != len(brush_points):
-            raise Exception('Number of points plotted on polygons not the number of actual polys!')
+        new_mesh = fbx.FbxMesh.Create(scene, node_name)
+        new_node.SetNodeAttribute(new_mesh)
 
-        brush_index += 1
+        # The hull points are shared by its polygons, so the hull stays closed
+        new_mesh.InitControlPoints(len(hull.points))
+        for i in range(0, len(hull.points)):
+            point = hull.points[i]
+            new_mesh.SetControlPointAt(fbx.FbxVector4(point[0], point[1], point[2]), i)
 
-    return len(entity.brushes)
+        for polygon in hull.polygons:
+            new_mesh.BeginPolygon()
+            for point_index in polygon:
+                new_mesh.AddPolygon(point_index)
+            new_mesh.EndPolygon()
 
 
 def save_scene(filename, fbx_manager, fbx_scene, as_ascii=False):
@@ -119,18 +318,293 @@ def get_ascii_format_index(fbx_manager):
     return format_index
 
 
+def get_peak_rss():
+    """ Obtain the peak resident set size of this process in megabytes, or None if it can't be queried """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, OSX reports bytes
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def print_axial_brushes():
+    """ Report how many of the brushes built during the last parse had their windings made the fast way """
+    built = id_map.Id2Map.Brush.built_brushes
+    axial = id_map.Id2Map.Brush.axial_brushes
+    if built > 0:
+        print('{0} of {1} brushes built ({2:.1f}%) took the axial fast path'.format(axial, built,
+                                                                                  100.0 * axial / built))
+
+
+def get_part_file(file_name, part_index):
+    """ The name of a part of an output written in parts, None stays None """
+    if file_name is None:
+        return None
+
+    base_name, extension = os.path.splitext(file_name)
+    return '{0}_part{1}{2}'.format(base_name, part_index, extension)
+
+
+def export_entities(fbx_manager, entities, output_file, options, brush_index=0, collision_file=None, atlas=None,
+                    lightmap_pool=None):
+    """
+    Creates an FBX scene holding the brushes of the entities and writes it out
+    :param fbx_manager: The FBX manager to create the scene with
+    :param entities: The entities to export
+    :param output_file: The FBX file to write
+    :param options: The command line options
+    :param brush_index: The brush index of the first brush, the brush nodes are named after it
+    :param collision_file: Optional FBX file to write the collision hulls into instead of the output file
+    :param atlas: Optional TextureAtlas to take the textures and UVs of the faces from
+    :param lightmap_pool: Optional multiprocessing pool to unwrap the lightmap UVs with
+    :return The number of brushes exported
+    """
+    fbx_scene = fbx.FbxScene.Create(fbx_manager, '')
+    materials = {}
+    collision = options.collision or collision_file is not None
+    collision_skip = [classname for classname in options.collision_skip.split(',') if classname]
+
+    # The static brushes of the map share one group of hulls, every other entity gets its own as it might move
+    static_hulls = []
+    hull_groups = [static_hulls]
+
+    map_lightmap_uvs = None
+    if options.lightmap:
+        print('Unwrapping lightmap UVs...')
+        # All brushes go out at once, so the worker processes get an even share
+        all_brushes = [brush for entity_in in entities for brush in entity_in.brushes]
+        map_lightmap_uvs = lightmap_uvs.generate_lightmap_uvs(all_brushes, options.lightmap_density,
+                                                              options.lightmap_padding, lightmap_pool)
+
+    # Create a scene node per brush containing the brushes UV'd mesh
+    first_brush_index = brush_index
+    for entity_in in entities:
+        entity_lightmap_uvs = None
+        if map_lightmap_uvs is not None:
+            entity_start = brush_index - first_brush_index
+            entity_lightmap_uvs = map_lightmap_uvs[entity_start:entity_start + len(entity_in.brushes)]
+        if collision:
+            entity_hulls = collision_hulls.build_entity_hulls(entity_in, brush_index, collision_skip)
+            if collision_hulls.is_static_entity(entity_in):
+                static_hulls.extend(entity_hulls)
+            elif entity_hulls:
+                hull_groups.append(entity_hulls)
+        brush_index += add_entity_to_scene(fbx_scene, entity_in, brush_index, materials, atlas, entity_lightmap_uvs)
+
+    if collision:
+        num_brush_hulls = sum(len(hulls) for hulls in hull_groups)
+        hull_groups = collision_hulls.optimize_hull_groups(hull_groups, options.collision_merge_size)
+        hulls = [hull for hulls in hull_groups for hull in hulls]
+        print('{0} collision hulls from {1} solid brushes'.format(len(hulls), num_brush_hulls))
+
+        if collision_file is not None:
+            # The colliders go into their own scene, so the render file does not have to be loaded for collision
+            collision_scene = fbx.FbxScene.Create(fbx_manager, '')
+            add_collision_hulls_to_scene(collision_scene, hulls)
+            save_scene(collision_file, fbx_manager, collision_scene, True)
+            collision_scene.Destroy()
+        else:
+            add_collision_hulls_to_scene(fbx_scene, hulls)
+
+    # Save the scene.
+    save_scene(output_file, fbx_manager, fbx_scene, True)
+    fbx_scene.Destroy()
+
+    return brush_index - first_brush_index
+
+
+def convert_map(fbx_manager, map_file, output_file, options, cache=None, collision_file=None, lightmap_pool=None,
+                geometry_file_name=None):
+    """
+    Converts a single map file into an FBX file
+    :param fbx_manager: The FBX manager to create the scene with
+    :param map_file: The Quake 2 or VtMR map file
+    :param output_file: The FBX file to write, in low memory mode the parts are named after it
+    :param options: The command line options
+    :param cache: Optional GeometryCache holding the brushes of the last conversion of this map file
+    :param collision_file: Optional FBX file to write the collision hulls into instead of the output file
+    :param lightmap_pool: Optional multiprocessing pool to unwrap the lightmap UVs with
+    :param geometry_file_name: Optional geometry file to also write the brush geometry into
+    :return The number of brushes exported
+    """
+    verbose = options.verbose
+
+    brush_index_in = 0
+    if options.from_geometry:
+        print('Loading brushes from geometry file...')
+        fbx_scene = fbx.FbxScene.Create(fbx_manager, '')
+        geometry = geometry_file.GeometryFile(map_file)
+        brush_index_in = add_geometry_to_scene(fbx_scene, geometry)
+        geometry.close()
+
+        # Save the scene.
+        save_scene(output_file, fbx_manager, fbx_scene, True)
+        fbx_scene.Destroy()
+    elif options.low_memory:
+        print('Streaming brushes from map file into fbx parts of {0} brushes...'.format(options.part_brushes))
+        # Only the brushes of the part being filled are in memory, once a part is full it is written out and
+        # dropped along with its scene. The entities of a part only hold the brushes that went into the part.
+        part_entities = []
+        num_part_brushes = 0
+        num_parts = 0
+        entity_in = None
+        for map_entity, brush in id_map.Id2Map.iter_map_brushes(map_file, verbose, options.textures):
+            if map_entity is not entity_in:
+                entity_in = map_entity
+                part_entities.append(id_map.Id2Map.Entity([]))
+                part_entities[-1].properties = map_entity.properties
+            part_entities[-1].brushes.append(brush)
+            num_part_brushes += 1
+
+            if num_part_brushes == options.part_brushes:
+                brush_index_in += export_entities(fbx_manager, part_entities, get_part_file(output_file, num_parts),
+                                                  options, brush_index_in, get_part_file(collision_file, num_parts),
+                                                  lightmap_pool=lightmap_pool)
+                num_parts += 1
+                part_entities = []
+                num_part_brushes = 0
+                # The entity might go on in the next part, which needs its own entity for its brushes
+                entity_in = None
+
+        if num_part_brushes > 0 or num_parts == 0:
+            brush_index_in += export_entities(fbx_manager, part_entities, get_part_file(output_file, num_parts),
+                                              options, brush_index_in, get_part_file(collision_file, num_parts),
+                                              lightmap_pool=lightmap_pool)
+            num_parts += 1
+        print('{0} brushes streamed into {1} fbx part(s)'.format(brush_index_in, num_parts))
+        print_axial_brushes()
+    else:
+        print('Collecting entities from map file and creating polygons...')
+        # Collect all of the brushes from the map file
+        map_data = id_map.Id2Map()
+        map_data.parse_map_file(map_file, verbose, options.textures, cache)
+        print_axial_brushes()
+
+        if options.csg:
+            print('Removing faces buried inside of other brushes...')
+            map_data.csg_entities()
+
+        if geometry_file_name is not None:
+            print('Writing geometry file {0}...'.format(geometry_file_name))
+            geometry_file.write_geometry_file(geometry_file_name, map_data.entities)
+
+        atlas = None
+        if options.atlas:
+            print('Packing the map textures into atlases...')
+            atlas = texture_atlas.build_texture_atlases(map_data.entities, output_file, options.atlas_size,
+                                                        options.atlas_padding, verbose)
+
+        print('{0} entities parsed, creating fbx'.format(len(map_data.entities)))
+        brush_index_in = export_entities(fbx_manager, map_data.entities, output_file, options,
+                                         collision_file=collision_file, atlas=atlas, lightmap_pool=lightmap_pool)
+
+    return brush_index_in
+
+
+def watch_maps(fbx_manager, map_files, output_files, collision_files, geometry_files, options, lightmap_pool=None):
+    """
+    Polls the map files for changes and reconverts each one when it is saved.
+    Parsed brushes, their windings and the texture information stay in memory between
+    conversions, so only the entities and brushes that were edited get rebuilt.
+    Runs until interrupted.
+    :param fbx_manager: The FBX manager to create the scenes with
+    :param map_files: The map files to watch
+    :param output_files: The FBX file to write for each map file
+    :param collision_files: The FBX file to write the collision hulls into for each map file, or None for each
+    :param geometry_files: The geometry file to write for each map file, or None for each
+    :param options: The command line options
+    :param lightmap_pool: Optional multiprocessing pool to unwrap the lightmap UVs with, shared by all conversions
+    """
+    caches = [id_map.Id2Map.GeometryCache() for _ in map_files]
+    mod_times = [None for _ in map_files]
+
+    print('Watching {0} map file(s), press Ctrl+C to stop'.format(len(map_files)))
+    try:
+        while True:
+            for i in range(0, len(map_files)):
+                try:
+                    mod_time = os.path.getmtime(map_files[i])
+                except OSError:
+                    # The editor might be in the middle of replacing the file
+                    continue
+
+                if mod_time == mod_times[i]:
+                    continue
+                mod_times[i] = mod_time
+
+                start_time = time.time()
+                try:
+                    convert_map(fbx_manager, map_files[i], output_files[i], options, caches[i], collision_files[i],
+                                lightmap_pool, geometry_files[i])
+                except Exception as e:
+                    # Most likely a half written file, the next save will try again
+                    print('Failed to convert {0}: {1}'.format(map_files[i], e))
+                    continue
+
+                print('Converted {0} into {1} in {2:.2f} seconds, {3} brushes rebuilt and {4} reused'.format(
+                    map_files[i], output_files[i], time.time() - start_time,
+                    caches[i].brushes_built, caches[i].brushes_reused))
+
+            time.sleep(options.poll_interval)
+    except KeyboardInterrupt:
+        print('Stopped watching')
+
+
 def main():
     # Get the necessary arguments
-    arg_parser = optparse.OptionParser(usage='usage: %prog -i [input dir] -o [output dir] [options]',
+    arg_parser = optparse.OptionParser(usage='usage: %prog -i [input dir] -o [output dir] [options] '
+                                             '[more map files to watch]',
                                        version="%prog 0.1")
     arg_parser.add_option('-o', '--output', action='store', type='string', dest='output', default=False,
-                          help='FBX output file name')
+                          help='FBX output file name, or the output folder when watching several map files')
     arg_parser.add_option('-i', '--input', action='store', type='string', dest='input', default=False,
                           help='The Quake 2 or VtMR map file')
     arg_parser.add_option('-t', '--textures', action='store', type='string', dest='textures', default=None,
                           help='The textures folder (optional)')
     arg_parser.add_option('-v', '--verbose', action='store_true', dest='verbose', default=False,
                           help='Spews information about the process (takes more time)')
+    arg_parser.add_option('-m', '--low-memory', action='store_true', dest='low_memory', default=False,
+                          help='Convert one brush at a time and write the output in parts of --part-brushes brushes')
+    arg_parser.add_option('--part-brushes', action='store', type='int', dest='part_brushes', default=4096,
+                          help='Brushes per output part in low memory mode, output_partN.fbx')
+    arg_parser.add_option('-c', '--csg', action='store_true', dest='csg', default=False,
+                          help='Remove the parts of faces which are buried inside of other brushes')
+    arg_parser.add_option('-a', '--atlas', action='store_true', dest='atlas', default=False,
+                          help='Pack the textures used by the map into atlases written next to the output (needs -t)')
+    arg_parser.add_option('--atlas-size', action='store', type='int', dest='atlas_size', default=2048,
+                          help='The maximum width and height of an atlas, a power of two')
+    arg_parser.add_option('--atlas-padding', action='store', type='int', dest='atlas_padding', default=2,
+                          help='Texels around each texture in an atlas, filled with its edge texels')
+    arg_parser.add_option('--collision', action='store_true', dest='collision', default=False,
+                          help='Add a UCX_ convex collision hull per solid brush to the output')
+    arg_parser.add_option('--collision-file', action='store', type='string', dest='collision_file', default=None,
+                          help='Write the collision hulls into this FBX file instead of the output, '
+                               'or into this folder when watching several map files')
+    arg_parser.add_option('--collision-skip', action='store', type='string', dest='collision_skip',
+                          default='trigger_', help='Comma separated entity classname prefixes without collision')
+    arg_parser.add_option('--collision-merge-size', action='store', type='float', dest='collision_merge_size',
+                          default=128.0, help='Merge box hulls sharing a face up to this size, 0 to never merge')
+    arg_parser.add_option('-l', '--lightmap', action='store_true', dest='lightmap', default=False,
+                          help='Generate a second UV set with non overlapping charts for lightmap baking')
+    arg_parser.add_option('--lightmap-density', action='store', type='float', dest='lightmap_density',
+                          default=1.0 / 16.0, help='Lightmap texels per map unit')
+    arg_parser.add_option('--lightmap-padding', action='store', type='int', dest='lightmap_padding', default=2,
+                          help='Lightmap texels left empty around each chart')
+    arg_parser.add_option('--lightmap-jobs', action='store', type='int', dest='lightmap_jobs',
+                          default=multiprocessing.cpu_count(), help='Number of processes unwrapping lightmap UVs')
+    arg_parser.add_option('--save-geometry', action='store', type='string', dest='save_geometry', default=None,
+                          help='Also write the brush geometry into this geometry file, for quick exports later on, '
+                               'or into this folder when watching several map files')
+    arg_parser.add_option('--from-geometry', action='store_true', dest='from_geometry', default=False,
+                          help='The input is a geometry file written by --save-geometry instead of a map file')
+    arg_parser.add_option('-w', '--watch', action='store_true', dest='watch', default=False,
+                          help='Keep running and reconvert the map file(s) every time they are saved')
+    arg_parser.add_option('--poll-interval', action='store', type='float', dest='poll_interval', default=0.25,
+                          help='Seconds between checks for modified map files when watching')
 
     (options, args) = arg_parser.parse_args()
 
@@ -140,6 +614,32 @@ def main():
         arg_parser.print_help()
         quit()
 
+    if options.watch and options.low_memory:
+        print('Low memory mode can not be used while watching, the brushes are kept around between conversions')
+        quit()
+
+    if options.low_memory and options.part_brushes < 1:
+        print('A part needs to hold at least one brush')
+        quit()
+
+    if options.csg and options.low_memory:
+        print('Low memory mode can not be used with CSG, brushes are written out before the brushes around them '
+              'are parsed')
+        quit()
+
+    if options.atlas and options.low_memory:
+        print('Low memory mode can not be used with atlases, all of the textures have to be known before exporting')
+        quit()
+
+    if options.save_geometry and options.low_memory:
+        print('Low memory mode can not be used when saving a geometry file, all of the brushes are needed')
+        quit()
+
+    if options.from_geometry and (options.csg or options.atlas or options.lightmap or options.collision or
+                                  options.collision_file or options.save_geometry or options.watch):
+        print('Only plain exports can be made from a geometry file')
+        quit()
+
     verbose = options.verbose
 
     if verbose:
@@ -147,26 +647,49 @@ def main():
 
     # Create the required FBX SDK data structures.
     g_fbx_manager = fbx.FbxManager.Create()
-    g_fbx_scene = fbx.FbxScene.Create(g_fbx_manager, '')
-
-    print('Collecting entities from map file and creating polygons...')
-    # Collect all of the brushes from the map file
-    map_data = id_map.Id2Map()
-    map_data.parse_map_file(options.input, verbose, options.textures)
 
-    brush_index_in = 0
-    print('{0} entities parsed, creating fbx'.format(len(map_data.entities)))
-    # Create a scene node per brush containing the brushes UV'd mesh
-    for entity_in in map_data.entities:
-        brush_index_in += add_entity_to_scene(g_fbx_scene, entity_in, brush_index_in)
+    # One pool for the whole run, so watching does not start new worker processes on every save
+    lightmap_pool = None
+    if options.lightmap and options.lightmap_jobs > 1:
+        lightmap_pool = multiprocessing.Pool(options.lightmap_jobs)
+
+    try:
+        if options.watch:
+            map_files = [options.input] + args
+            if len(map_files) == 1:
+                output_files = [options.output]
+                collision_files = [options.collision_file]
+                geometry_files = [options.save_geometry]
+            else:
+                # Several maps, the output is a folder which receives an FBX per map file
+                map_names = [os.path.splitext(os.path.basename(map_file))[0] for map_file in map_files]
+                output_files = [os.path.join(options.output, map_name + '.fbx') for map_name in map_names]
+                # The collision folder might be the output folder, so the collision files get their own names
+                collision_files = [None for _ in map_files]
+                if options.collision_file:
+                    collision_files = [os.path.join(options.collision_file, map_name + '_collision.fbx')
+                                       for map_name in map_names]
+                geometry_files = [None for _ in map_files]
+                if options.save_geometry:
+                    geometry_files = [os.path.join(options.save_geometry, map_name + '.geom') for map_name in map_names]
+            watch_maps(g_fbx_manager, map_files, output_files, collision_files, geometry_files, options, lightmap_pool)
+        else:
+            convert_map(g_fbx_manager, options.input, options.output, options, collision_file=options.collision_file,
+                        lightmap_pool=lightmap_pool, geometry_file_name=options.save_geometry)
+    finally:
+        if lightmap_pool is not None:
+            lightmap_pool.close()
+            lightmap_pool.join()
 
-    # Save the scene.
-    save_scene(options.output, g_fbx_manager, g_fbx_scene, True)
     #
     # Destroy the fbx manager explicitly, which recursively destroys
     # all the objects that have been created with it.
     g_fbx_manager.Destroy()
-    del g_fbx_manager, g_fbx_scene
+    del g_fbx_manager
+
+    peak_rss = get_peak_rss()
+    if peak_rss is not None:
+        print('Peak memory use: {0:.1f} MB'.format(peak_rss))
 
 
 if __name__ == '__main__':
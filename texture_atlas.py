@@ -0,0 +1,280 @@
+import math
+import os
+from PIL import Image
+import id_map
+
+__author__ = 'Ryan Sheffer'
+
+
+class SkylinePacker:
+    """
+    Packs rectangles into a fixed size area using the skyline bottom left heuristic.
+    The skyline is the top edge of everything packed so far, kept as a list of [x, y, width] segments.
+    A rectangle is placed on top of the skyline where it ends up the lowest, which keeps packing
+    fast even with thousands of rectangles since only the skyline segments are ever looked at.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [[0, 0, width]]
+        self.used_width = 0
+        self.used_height = 0
+
+    def fit(self, index, width, height):
+        """
+        Find the height a rectangle would sit at if it was placed at the start of a skyline segment
+        :return The y position for the rectangle or -1 if it does not fit there
+        """
+        x = self.skyline[index][0]
+        if x + width > self.width:
+            return -1
+
+        y = 0
+        width_left = width
+        while width_left > 0:
+            if index == len(self.skyline):
+                return -1
+            y = max(y, self.skyline[index][1])
+            if y + height > self.height:
+                return -1
+            width_left -= self.skyline[index][2]
+            index += 1
+
+        return y
+
+    def insert(self, width, height):
+        """
+        Place a rectangle in the packing area
+        :return The (x, y) position of the rectangle or None if there is no space left for it
+        """
+        best_index = -1
+        best_x = 0
+        best_y = self.height
+        best_width = self.width
+        for i in range(0, len(self.skyline)):
+            y = self.fit(i, width, height)
+            if y == -1:
+                continue
+
+            # prefer the lowest position, and for ties the narrowest segment to waste the least space
+            if y < best_y or (y == best_y and self.skyline[i][2] < best_width):
+                best_index = i
+                best_x = self.skyline[i][0]
+                best_y = y
+                best_width = self.skyline[i][2]
+
+        if best_index == -1:
+            return None
+
+        self.add_level(best_index, best_x, best_y + height, width)
+        self.used_width = max(self.used_width, best_x + width)
+        self.used_height = max(self.used_height, best_y + height)
+        return best_x, best_y
+
+    def add_level(self, index, x, y, width):
+        """ Raise the skyline under a newly placed rectangle """
+        self.skyline.insert(index, [x, y, width])
+
+        # shrink or remove the segments the new one now covers
+        i = index + 1
+        while i < len(self.skyline):
+            prev_end = self.skyline[i - 1][0] + self.skyline[i - 1][2]
+            if self.skyline[i][0] >= prev_end:
+                break
+
+            shrink = prev_end - self.skyline[i][0]
+            self.skyline[i][0] += shrink
+            self.skyline[i][2] -= shrink
+            if self.skyline[i][2] > 0:
+                break
+
+            del self.skyline[i]
+
+        # merge neighbouring segments of the same height
+        i = 0
+        while i < len(self.skyline) - 1:
+            if self.skyline[i][1] == self.skyline[i + 1][1]:
+                self.skyline[i][2] += self.skyline[i + 1][2]
+                del self.skyline[i + 1]
+            else:
+                i += 1
+
+
+def next_power_of_two(value):
+    """ The smallest power of two greater or equal to value """
+    return 1 << max(0, int(math.ceil(math.log(max(value, 1), 2))))
+
+
+def pack_rectangles(sizes, max_size):
+    """
+    Packs rectangles into as few pages as possible
+    :param sizes: List of (width, height) to pack, none of them can be bigger than max_size
+    :param max_size: The width and height of a page
+    :return A list of (page index, x, y) for each size, and a list of the (width, height) each page
+            needs, rounded up to a power of two
+    """
+    placements = [None for _ in sizes]
+    pages = []
+
+    # Tallest first gives the skyline the least amount of jagged edges to deal with
+    order = sorted(range(0, len(sizes)), key=lambda k: (sizes[k][1], sizes[k][0]), reverse=True)
+    for i in order:
+        width, height = sizes[i]
+        for page_index in range(0, len(pages)):
+            pos = pages[page_index].insert(width, height)
+            if pos is not None:
+                placements[i] = (page_index, pos[0], pos[1])
+                break
+        else:
+            pages.append(SkylinePacker(max_size, max_size))
+            pos = pages[-1].insert(width, height)
+            placements[i] = (len(pages) - 1, pos[0], pos[1])
+
+    page_sizes = [(next_power_of_two(page.used_width), next_power_of_two(page.used_height)) for page in pages]
+    return placements, page_sizes
+
+
+class TextureAtlas:
+    """
+    Textures of the map packed into a few atlas pages.
+    Faces are not modified, the exporter asks the atlas for the texture and UVs of each face. That keeps the
+    parsed brushes valid for other outputs, and for the geometry cache used when watching maps.
+    """
+    # slack allowed on the UV range of a face before it is considered to tile
+    TILE_EPSILON = 0.001
+
+    def __init__(self):
+        self.pages = []  # Id2Map.Texture of each atlas page
+        self.placements = {}  # texture path -> (page index, x, y)
+        self.tiling_polygons = 0
+
+    @staticmethod
+    def get_uv_tile(winding):
+        """
+        Find which repeat of the texture a polygon lies in. Polygons with a texture that repeats across them can't
+        be moved into an atlas, as the atlas neighbours would show up instead of the repeats.
+        :return The (s, t) offset of the texture repeat the polygon is in, or None if the polygon tiles the texture
+        """
+        points = winding.points[:winding.numpoints]
+        tile = [0, 0]
+        for k in range(0, 2):
+            low = min(point[3 + k] for point in points)
+            high = max(point[3 + k] for point in points)
+            tile[k] = math.floor(low + TextureAtlas.TILE_EPSILON)
+            if high - tile[k] > 1.0 + TextureAtlas.TILE_EPSILON:
+                return None
+
+        return tile
+
+    def remap_face(self, face, winding):
+        """
+        Get the atlas page and the atlas UVs of a polygon of a face
+        :return (atlas page texture, list of (s, t)) or None if the polygon keeps its own texture.
+                The t of the atlas UVs runs up the page, the way FBX expects it.
+        """
+        if face.texture is None or face.texture.texture_path not in self.placements:
+            return None
+
+        tile = TextureAtlas.get_uv_tile(winding)
+        if tile is None:
+            return None
+
+        page_index, x, y = self.placements[face.texture.texture_path]
+        page = self.pages[page_index]
+        uvs = []
+        for i in range(0, winding.numpoints):
+            point = winding.points[i]
+            s = (x + (point[3] - tile[0]) * face.texture.width) / float(page.width)
+            t = 1.0 - (y + (point[4] - tile[1]) * face.texture.height) / float(page.height)
+            uvs.append((s, t))
+
+        return page, uvs
+
+
+def paste_with_edges(page_image, image, x, y, padding):
+    """
+    Pastes a texture into an atlas page, filling the padding around it with its edge texels.
+    Filtering and mip maps then blend in the texture's own edges instead of its neighbours or empty space.
+    :param page_image: The atlas page image
+    :param image: The texture image
+    :param x: Left of the texture in the page, not counting the padding
+    :param y: Top of the texture in the page, not counting the padding
+    :param padding: Texels of padding around the texture
+    """
+    page_image.paste(image, (x, y))
+    if padding <= 0:
+        return
+
+    width, height = image.size
+    # (crop box of the edge texels, size to stretch them to, where they go)
+    edges = [((0, 0, width, 1), (width, padding), (x, y - padding)),
+             ((0, height - 1, width, height), (width, padding), (x, y + height)),
+             ((0, 0, 1, height), (padding, height), (x - padding, y)),
+             ((width - 1, 0, width, height), (padding, height), (x + width, y)),
+             ((0, 0, 1, 1), (padding, padding), (x - padding, y - padding)),
+             ((width - 1, 0, width, 1), (padding, padding), (x + width, y - padding)),
+             ((0, height - 1, 1, height), (padding, padding), (x - padding, y + height)),
+             ((width - 1, height - 1, width, height), (padding, padding), (x + width, y + height))]
+    for box, size, position in edges:
+        page_image.paste(image.crop(box).resize(size, Image.NEAREST), position)
+
+
+def build_texture_atlases(entities, output_file, max_size=2048, padding=2, verbose=False):
+    """
+    Packs the textures used by the map into atlas pages and writes them next to the output file
+    :param entities: The parsed map entities
+    :param output_file: The FBX file being exported, the atlas pages are named after it
+    :param max_size: The width and height limit of an atlas page
+    :param padding: Texels around each texture, filled with its edges, to avoid bleeding between them when filtering
+    :param verbose: Print out the textures which could not go into an atlas
+    :return The TextureAtlas to remap the face UVs with
+    """
+    atlas = TextureAtlas()
+
+    # Only textures with at least one face that does not tile them are worth packing
+    textures = {}
+    for entity in entities:
+        for brush in entity.brushes:
+            for face in brush.faces:
+                if face.texture is None:
+                    continue
+                for winding in face.visible_windings():
+                    if TextureAtlas.get_uv_tile(winding) is None:
+                        atlas.tiling_polygons += 1
+                    elif face.texture.texture_path not in textures:
+                        textures[face.texture.texture_path] = face.texture
+
+    texture_list = []
+    for texture_path in sorted(textures.keys()):
+        texture = textures[texture_path]
+        if texture.width + padding * 2 > max_size or texture.height + padding * 2 > max_size:
+            if verbose:
+                print('{0} is too big for a {1} atlas, leaving it as is'.format(texture_path, max_size))
+            continue
+        texture_list.append(texture)
+
+    sizes = [(texture.width + padding * 2, texture.height + padding * 2) for texture in texture_list]
+    placements, page_sizes = pack_rectangles(sizes, max_size)
+
+    base_name = os.path.splitext(output_file)[0]
+    images = []
+    for page_index in range(0, len(page_sizes)):
+        width, height = page_sizes[page_index]
+        page_path = '{0}_atlas{1}.tga'.format(base_name, page_index)
+        atlas.pages.append(id_map.Id2Map.Texture(width, height, page_path))
+        images.append(Image.new('RGBA', (width, height)))
+
+    for i in range(0, len(texture_list)):
+        texture = texture_list[i]
+        page_index, x, y = placements[i]
+        atlas.placements[texture.texture_path] = (page_index, x + padding, y + padding)
+        paste_with_edges(images[page_index], Image.open(texture.texture_path).convert('RGBA'),
+                         x + padding, y + padding, padding)
+
+    for page_index in range(0, len(images)):
+        images[page_index].save(atlas.pages[page_index].texture_path)
+
+    print('Packed {0} textures into {1} atlas page(s), {2} polygons tile their texture and keep it'.format(
+        len(texture_list), len(atlas.pages), atlas.tiling_polygons))
+
+    return atlas